@@ -61,7 +61,14 @@ public class GhidraDataDump extends GhidraScript {
         // Generate Timestamp: YYYY-MM-DD_HH-mm-ss
         String timeStamp = new SimpleDateFormat("yyyy-MM-dd_HH-mm-ss").format(new Date());
         
-        String fileName = safeName + "_" + timeStamp + ".json";
+        // Optional per-run suffix from the Python server, so parallel runs on binaries with
+        // the same name that finish within the same second don't overwrite each other's output
+        String runId = System.getenv("GHIDRA_ANALYSIS_RUN_ID");
+        String fileName = safeName + "_" + timeStamp;
+        if (runId != null && !runId.trim().isEmpty()) {
+            fileName += "_" + runId.replaceAll("[^a-zA-Z0-9.-]", "_");
+        }
+        fileName += ".json";
         File outputFile = new File(outputDir, fileName);
 
         // 3. START EXTRACTION
@@ -3,11 +3,24 @@ import subprocess
 import json
 import tempfile
 import hashlib
+import mmap
 import shutil
 import sys
-from typing import Dict, Any
+import threading
+import uuid
+import contextlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Dict, Any, List, Optional, Set, Tuple
 from mcp.server.fastmcp import FastMCP
 
+# Optional: orjson parses and serializes large analysis dumps several times faster than stdlib json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # --- PORTABLE CONFIGURATION ---
 
 # 1. Base Directory: Where this python file is located
@@ -28,46 +41,196 @@ GHIDRA_HEADLESS_PATH = os.getenv("GHIDRA_HEADLESS_PATH", r"C:\ghidra_12.0.1_PUBL
 
 # ------------------------------
 
+# Ensure output directory exists (once, rather than on every analysis)
+os.makedirs(LOGS_DIR, exist_ok=True)
+
+# Pass the SAFE relative output directory to Java. Built once; it never changes per analysis.
+GHIDRA_ENV = {**os.environ, "GHIDRA_ANALYSIS_OUTPUT": LOGS_DIR}
+
 # Force UTF-8 for Windows consoles
 if sys.platform == "win32":
     sys.stdout.reconfigure(encoding='utf-8')
 
 mcp = FastMCP("Ghidra Analyst")
 
-# Session Cache
-current_session_context: Dict[str, str] = {} 
+# Session Cache: binary_path -> {"json_path", "mtime_ns", "size", "functions", "strings"}
+# (mtime/size of the binary when it was analyzed, function/string counts of the result)
+current_session_context: Dict[str, Dict[str, Any]] = {} 
+
+# Printed by GhidraDataDump.java in front of the generated JSON path
+JSON_TAG = "GHIDRA_JSON_GENERATED:"
+
+NO_ANALYSIS_ERROR = "Error: No analysis found. Run 'analyze_binary' first."
+
+# Lines of Ghidra output kept for the "Analysis Failed" debug message
+STDOUT_TAIL_LINES = 200
+
+# Parsed JSON Cache: json_path -> ((mtime_ns, size), data, views), least recently used first.
+# "views" holds results derived from data (previews, indexes) so they are built once per dump.
+# Bounded so a long session over many binaries doesn't keep every dump in memory.
+PARSED_CACHE_SIZE = 4
+parsed_json_cache: "OrderedDict[str, Tuple[Tuple[int, int], Dict[str, Any], Dict[str, Any]]]" = OrderedDict()
+parsed_json_lock = threading.Lock()
 
-def get_file_hash(filepath: str) -> str:
+# Persistent Cache: fingerprint -> {"json": file name in LOGS_DIR, "functions", "strings"}.
+# Lets a restarted server reuse earlier analyses instead of running Ghidra again.
+ANALYSIS_INDEX_NAME = "analysis_index.json"
+ANALYSIS_INDEX_PATH = os.path.join(LOGS_DIR, ANALYSIS_INDEX_NAME)
+analysis_index_lock = threading.Lock()
+# Last index read from disk, keyed by the file's (mtime_ns, size) so repeat lookups only stat it
+analysis_index_cache: Tuple[Optional[Tuple[int, int]], Dict[str, Dict[str, Any]]] = (None, {})
+
+# Default concurrent Ghidra runs for analyze_binaries; each one is a separate JVM
+MAX_PARALLEL_ANALYSES = max(1, (os.cpu_count() or 2) // 2)
+
+FINGERPRINT_WINDOW = 64 * 1024
+
+# Ghidra paths confirmed to exist; only positive results are remembered
+ghidra_found_paths: Set[str] = set()
+
+def get_file_fingerprint(filepath: str) -> str:
+    """
+    Cheap identity for a binary: size + mtime + SHA-256 of the first and last
+    64 KiB. Constant cost regardless of file size, unlike a full-file hash.
+    """
     sha256 = hashlib.sha256()
     try:
+        st = os.stat(filepath)
+        sha256.update(st.st_size.to_bytes(8, "little"))
+        # Signed: files dated before 1970 have a negative mtime
+        sha256.update(st.st_mtime_ns.to_bytes(8, "little", signed=True))
         with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                sha256.update(chunk)
+            sha256.update(f.read(FINGERPRINT_WINDOW))
+            if st.st_size > 2 * FINGERPRINT_WINDOW:
+                f.seek(-FINGERPRINT_WINDOW, os.SEEK_END)
+                sha256.update(f.read(FINGERPRINT_WINDOW))
+            elif st.st_size > FINGERPRINT_WINDOW:
+                sha256.update(f.read())
         return sha256.hexdigest()
     except FileNotFoundError:
         return "file_not_found"
 
+def find_run_json(directory: str, run_id: str) -> Optional[str]:
+    # Every run names its dump with its own run id, so this can't pick up another run's output
+    suffix = f"_{run_id}.json"
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(suffix):
+                return entry.path
+    return None
+
+def ghidra_available(headless_path: str) -> bool:
+    # Once found, the install doesn't move while the server runs. Keep checking while it's
+    # missing so installing Ghidra or mounting its drive later works without a restart.
+    if headless_path not in ghidra_found_paths:
+        if not os.path.exists(headless_path):
+            return False
+        ghidra_found_paths.add(headless_path)
+    return True
+
+def load_analysis_index() -> Dict[str, Dict[str, Any]]:
+    global analysis_index_cache
+    try:
+        st = os.stat(ANALYSIS_INDEX_PATH)
+    except OSError:
+        return {}
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached_stamp, cached_index = analysis_index_cache
+    if cached_stamp == stamp:
+        return cached_index
+    try:
+        index = read_json(ANALYSIS_INDEX_PATH)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(index, dict):
+        index = {}
+    analysis_index_cache = (stamp, index)
+    return index
+
+def is_valid_index_entry(entry: Any) -> bool:
+    # Hand edits or another schema version make an entry a miss, not a crash
+    return (isinstance(entry, dict) and isinstance(entry.get("json"), str)
+            and isinstance(entry.get("functions"), int) and isinstance(entry.get("strings"), int))
+
+def record_analysis(fingerprint: str, session: Dict[str, Any]) -> None:
+    with analysis_index_lock:
+        # Copy so readers holding the cached index never see a half-applied update
+        index = dict(load_analysis_index())
+        index[fingerprint] = {
+            "json": os.path.relpath(session["json_path"], LOGS_DIR),
+            "functions": session["functions"],
+            "strings": session["strings"],
+        }
+        tmp_path = f"{ANALYSIS_INDEX_PATH}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(dump_json(index))
+            os.replace(tmp_path, ANALYSIS_INDEX_PATH)
+        except OSError:
+            # The index only saves future Ghidra runs; never fail an analysis over it.
+            # os.replace can fail on Windows while another worker has the index open.
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+
+def format_analysis_summary(session: Dict[str, Any], cached: bool = False) -> str:
+    rel_path = os.path.relpath(session["json_path"], BASE_DIR)
+    status = "Using existing analysis" if cached else "Analysis saved to"
+    return f"Success! {status}: {rel_path}\nFunctions found: {session['functions']}\nStrings found: {session['strings']}"
+
 @mcp.tool()
-def analyze_binary(binary_path: str) -> str:
+def analyze_binary(binary_path: str, force: bool = False) -> str:
     """
     Analyzes a binary using Ghidra and saves the results to a JSON file
-    in the 'analysis_output' folder.
+    in the 'analysis_output' folder. If the binary was already analyzed (this
+    session or a previous one) and hasn't changed, the existing result is reused
+    unless force=True.
     """
-    if not os.path.exists(binary_path):
+    try:
+        binary_stat = os.stat(binary_path)
+    except OSError:
         return f"Error: File {binary_path} not found."
 
-    # Ensure output directory exists
-    if not os.path.exists(LOGS_DIR):
-        os.makedirs(LOGS_DIR)
+    # Skip Ghidra entirely if this exact file (same mtime and size) was already analyzed
+    session = current_session_context.get(binary_path)
+    if (not force and session is not None
+            and session["mtime_ns"] == binary_stat.st_mtime_ns
+            and session["size"] == binary_stat.st_size):
+        # Counts were recorded at analysis time, so there's no need to parse the dump again
+        if os.path.exists(session["json_path"]):
+            return format_analysis_summary(session, cached=True)
+
+    # Same for a binary analyzed by an earlier server run, matched by content fingerprint
+    try:
+        fingerprint = get_file_fingerprint(binary_path)
+    except OSError as e:
+        # e.g. a directory or a file we aren't allowed to read
+        return f"Error: Could not read {binary_path}: {str(e)}"
+    if not force:
+        indexed = load_analysis_index().get(fingerprint)
+        # An invalid entry falls through to a fresh Ghidra run, which overwrites it
+        if is_valid_index_entry(indexed):
+            json_path = os.path.join(LOGS_DIR, indexed["json"])
+            if os.path.exists(json_path):
+                session = {
+                    "json_path": json_path,
+                    "mtime_ns": binary_stat.st_mtime_ns,
+                    "size": binary_stat.st_size,
+                    "functions": indexed["functions"],
+                    "strings": indexed["strings"],
+                }
+                current_session_context[binary_path] = session
+                return format_analysis_summary(session, cached=True)
 
     # Check if Ghidra path is valid
-    if not os.path.exists(GHIDRA_HEADLESS_PATH):
+    if not ghidra_available(GHIDRA_HEADLESS_PATH):
         return (f"CONFIGURATION ERROR: Could not find Ghidra at: {GHIDRA_HEADLESS_PATH}\n"
                 f"Please set the 'GHIDRA_HEADLESS_PATH' environment variable to your Ghidra 'analyzeHeadless' executable.")
 
     # Create Temp Project Folder (deleted after analysis)
     temp_proj_dir = tempfile.mkdtemp()
-    proj_name = f"ghidra_proj_{get_file_hash(binary_path)[:8]}"
+    proj_name = f"ghidra_proj_{fingerprint[:8]}"
+    # Tags this run's output file; parallel runs share LOGS_DIR
+    run_id = uuid.uuid4().hex[:12]
 
     cmd = [
         GHIDRA_HEADLESS_PATH,
@@ -80,19 +243,17 @@ def analyze_binary(binary_path: str) -> str:
         "-analysisTimeoutPerFile", "600"
     ]
 
-    # Pass the SAFE relative output directory to Java
-    env = os.environ.copy()
-    env["GHIDRA_ANALYSIS_OUTPUT"] = LOGS_DIR
-
     try:
         print(f"[INFO] Starting Analysis on: {binary_path}")
         print(f"[INFO] Saving Output to: {LOGS_DIR}")
         
-        result = subprocess.run(
+        # Stream the log line by line instead of buffering it all (it can run to tens of MB).
+        # stderr is merged in so a full stderr pipe can't stall the JVM.
+        proc = subprocess.Popen(
             cmd, 
-            env=env, 
-            check=False, 
-            capture_output=True, 
+            env={**GHIDRA_ENV, "GHIDRA_ANALYSIS_RUN_ID": run_id}, 
+            stdout=subprocess.PIPE, 
+            stderr=subprocess.STDOUT, 
             text=True, 
             encoding='utf-8', 
             errors='replace'
@@ -100,69 +261,179 @@ def analyze_binary(binary_path: str) -> str:
         
         # --- PARSING LOGIC ---
         generated_json_path = None
+        stdout_tail = deque(maxlen=STDOUT_TAIL_LINES)
         
         # 1. Try to find the tag from Java stdout
-        for line in result.stdout.splitlines():
-            if "GHIDRA_JSON_GENERATED:" in line:
-                raw_path = line.split("GHIDRA_JSON_GENERATED:")[1].strip()
-                generated_json_path = raw_path.strip('"').strip("'")
-                break
-        
-        # 2. Fallback: Find newest file in LOGS_DIR
-        if not generated_json_path or not os.path.exists(generated_json_path):
-            files = [os.path.join(LOGS_DIR, f) for f in os.listdir(LOGS_DIR) if f.endswith(".json")]
-            if files:
-                generated_json_path = max(files, key=os.path.getctime)
-            else:
-                return f"Analysis Failed. No JSON found in {LOGS_DIR}.\nDebug Stdout:\n{result.stdout}\n"
-
-        current_session_context[binary_path] = generated_json_path
+        with proc:
+            for line in proc.stdout:
+                stdout_tail.append(line)
+                if generated_json_path is None:
+                    _, tag, raw_path = line.partition(JSON_TAG)
+                    if tag:
+                        generated_json_path = raw_path.strip().strip('"').strip("'")
         
-        with open(generated_json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        # 2. Fallback: Find this run's file in LOGS_DIR (never another run's newer dump)
+        owned_by_run = (bool(generated_json_path) and os.path.exists(generated_json_path)
+                        and os.path.basename(generated_json_path).endswith(f"_{run_id}.json"))
+        if not owned_by_run:
+            generated_json_path = find_run_json(LOGS_DIR, run_id)
+            if not generated_json_path:
+                return f"Analysis Failed. No JSON found in {LOGS_DIR}.\nDebug Stdout:\n{''.join(stdout_tail)}\n"
+
+        data = load_json_cached(generated_json_path)
+
+        session = {
+            "json_path": generated_json_path,
+            "mtime_ns": binary_stat.st_mtime_ns,
+            "size": binary_stat.st_size,
+            "functions": len(data['functions']),
+            "strings": len(data['strings']),
+        }
+        current_session_context[binary_path] = session
+        # Safe to index: the dump carries this run's id, so it can't be another binary's output
+        record_analysis(fingerprint, session)
 
         shutil.rmtree(temp_proj_dir, ignore_errors=True)
         
-        rel_path = os.path.relpath(generated_json_path, BASE_DIR)
-        return f"Success! Analysis saved to: {rel_path}\nFunctions found: {len(data['functions'])}\nStrings found: {len(data['strings'])}"
+        return format_analysis_summary(session)
 
     except Exception as e:
         return f"System Error: {str(e)}"
 
-def load_latest_json(binary_path: str):
+@mcp.tool()
+def analyze_binaries(binary_paths: List[str], force: bool = False, max_workers: Optional[int] = None) -> str:
+    """
+    Analyzes several binaries at once, running up to max_workers Ghidra processes
+    in parallel (default: half the CPU cores). Lower it on machines with little RAM,
+    since every process is a separate JVM. Returns the analyze_binary result for each path.
+    """
+    if not binary_paths:
+        return "Error: No binary paths given."
+    if max_workers is not None and max_workers < 1:
+        return "Error: max_workers must be at least 1."
+
+    # Run each distinct file once: repeated paths, symlinks and hardlinks share (device, inode)
+    primary_for: Dict[str, str] = {}
+    seen: Dict[Any, str] = {}
+    for path in binary_paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            primary_for[path] = path  # analyze_binary reports the missing file
+            continue
+        # Some filesystems report st_ino == 0; fall back to the resolved path there
+        key = (st.st_dev, st.st_ino) if st.st_ino else os.path.realpath(path)
+        primary_for[path] = seen.setdefault(key, path)
+    unique_paths = list(dict.fromkeys(primary_for.values()))
+
+    workers = min(len(unique_paths), max_workers or MAX_PARALLEL_ANALYSES)
+    # Threads are enough: each worker just waits on its own Ghidra subprocess
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = dict(zip(unique_paths, executor.map(lambda path: analyze_binary(path, force), unique_paths)))
+
+    # Aliases share the analysis, so the query tools work with whichever path the caller used
+    for path, primary in primary_for.items():
+        if path != primary and primary in current_session_context:
+            current_session_context[path] = current_session_context[primary]
+
+    return "\n\n".join(f"[{path}]\n{results[primary_for[path]]}" for path in binary_paths)
+
+def read_json(json_path: str):
+    if orjson is not None:
+        with open(json_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return orjson.loads(f.read())  # mmap can't map an empty file
+            # Parse straight from the page cache; no intermediate bytes copy of the file
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                return orjson.loads(view)
+    with open(json_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def dump_json(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    # Same text as orjson: compact separators, non-ASCII left as UTF-8
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+def load_cached_entry(json_path: str) -> Optional[Tuple[Tuple[int, int], Dict[str, Any], Dict[str, Any]]]:
+    try:
+        st = os.stat(json_path)
+    except OSError:
+        with parsed_json_lock:
+            parsed_json_cache.pop(json_path, None)
+        return None
+
+    # Size as well as mtime: coarse-mtime filesystems can hide a quick rewrite
+    stamp = (st.st_mtime_ns, st.st_size)
+    with parsed_json_lock:
+        cached = parsed_json_cache.get(json_path)
+        if cached is not None and cached[0] == stamp:
+            parsed_json_cache.move_to_end(json_path)
+            return cached
+
+    # Parse outside the lock so one large dump doesn't block lookups for other binaries
+    entry = (stamp, read_json(json_path), {})
+    with parsed_json_lock:
+        parsed_json_cache[json_path] = entry
+        parsed_json_cache.move_to_end(json_path)
+        while len(parsed_json_cache) > PARSED_CACHE_SIZE:
+            parsed_json_cache.popitem(last=False)
+    return entry
+
+def load_json_cached(json_path: str) -> Optional[Dict[str, Any]]:
+    entry = load_cached_entry(json_path)
+    return entry[1] if entry is not None else None
+
+def load_analysis_view(binary_path: str, name: str, build: Callable[[Dict[str, Any]], Any]):
     if binary_path not in current_session_context:
         return None
-    json_path = current_session_context[binary_path]
-    if not os.path.exists(json_path):
+    entry = load_cached_entry(current_session_context[binary_path]["json_path"])
+    if entry is None:
         return None
-    with open(json_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    _, data, views = entry
+    if name not in views:
+        views[name] = build(data)
+    return views[name]
+
+def build_functions_preview(data: Dict[str, Any]) -> str:
+    funcs = [f"{f['name']} (@ {f['entry']})" for f in islice(data['functions'], 300)]
+    return dump_json(funcs)
+
+def build_functions_by_name(data: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    functions_by_name: Dict[str, Dict[str, Any]] = {}
+    for f in data['functions']:
+        # First definition wins, matching the old linear scan when names repeat
+        functions_by_name.setdefault(f['name'], f)
+    return functions_by_name
+
+def build_strings_preview(data: Dict[str, Any]) -> str:
+    # Stop at the 100th match instead of filtering every string in the binary
+    valid_strings = islice((s['value'] for s in data['strings'] if len(s['value']) > 5), 100)
+    return dump_json(list(valid_strings))
 
 @mcp.tool()
 def list_functions(binary_path: str) -> str:
-    data = load_latest_json(binary_path)
-    if not data:
-        return "Error: No analysis found. Run 'analyze_binary' first."
-    funcs = [f"{f['name']} (@ {f['entry']})" for f in data['functions']]
-    return json.dumps(funcs[:300]) 
+    preview = load_analysis_view(binary_path, "functions_preview", build_functions_preview)
+    if preview is None:
+        return NO_ANALYSIS_ERROR
+    return preview
 
 @mcp.tool()
 def read_function_code(binary_path: str, function_name: str) -> str:
-    data = load_latest_json(binary_path)
-    if not data:
-        return "Error: No analysis found. Run 'analyze_binary' first."
-    for f in data['functions']:
-        if f['name'] == function_name:
-            return f['code']
-    return f"Function '{function_name}' not found."
+    functions_by_name = load_analysis_view(binary_path, "functions_by_name", build_functions_by_name)
+    if functions_by_name is None:
+        return NO_ANALYSIS_ERROR
+    f = functions_by_name.get(function_name)
+    if f is None:
+        return f"Function '{function_name}' not found."
+    return f['code']
 
 @mcp.tool()
 def read_strings(binary_path: str) -> str:
-    data = load_latest_json(binary_path)
-    if not data:
-        return "Error: No analysis found. Run 'analyze_binary' first."
-    valid_strings = [s['value'] for s in data['strings'] if len(s['value']) > 5]
-    return json.dumps(valid_strings[:100])
+    preview = load_analysis_view(binary_path, "strings_preview", build_strings_preview)
+    if preview is None:
+        return NO_ANALYSIS_ERROR
+    return preview
 
 if __name__ == "__main__":
     mcp.run()
\ No newline at end of file